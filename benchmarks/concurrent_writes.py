@@ -0,0 +1,199 @@
+# Hammers one budget with concurrent writes and checks that balances and
+# running totals still match the ledger afterwards.
+#
+#   python benchmarks/concurrent_writes.py --processes 4 --threads 8 --requests 100
+#
+# Every thread logs in with its own test client and posts a mix of income,
+# expenses, transfers in both directions between two budgets, edits and
+# deletes. Threads edit and delete their own rows and also a shared set of
+# --contested rows, so several requests race on the same row; a 404 for a
+# contested row another thread deleted first is expected. Lost updates and
+# double reverts show up as a balance that differs from the ledger sum,
+# lock-order deadlocks and unretried lock errors as failed requests.
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db, upgrade_db, reconcile_rollups, Budget, Category, Transaction, User  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+USERNAME, PASSWORD = 'loadtest', 'loadtest'
+MAIN_BUDGET, OTHER_BUDGET = 1, 2
+INITIAL_BALANCE_CENTS = 100000
+
+
+def make_app(db_path):
+    return create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(db_path)}',
+                       'SECRET_KEY': 'concurrent-writes', 'PAGE_CACHE_URL': 'null://',
+                       'TEMPLATE_CACHE_DIR': None})
+
+
+def seed(db_path, categories, contested):
+    app = make_app(db_path)
+    with app.app_context():
+        upgrade_db()
+        user = User(username=USERNAME, password_hash=generate_password_hash(PASSWORD))
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Budget(id=MAIN_BUDGET, name='Main', user_id=user.id, balance_cents=INITIAL_BALANCE_CENTS))
+        db.session.add(Budget(id=OTHER_BUDGET, name='Other', user_id=user.id, balance_cents=INITIAL_BALANCE_CENTS))
+        for i in range(categories):
+            db.session.add(Category(name=f'Category {i}', budget_id=MAIN_BUDGET, budgeted_amount_cents=10000))
+        db.session.commit()
+        category_ids = [c.id for c in Category.query.filter_by(budget_id=MAIN_BUDGET)]
+
+    # Contested rows go through the app so that their rollups are right;
+    # every fourth one is a transfer
+    client = app.test_client()
+    client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+    for n in range(contested):
+        data = {'description': f'contested {n}', 'amount': '10.00', 'date': '2024-06-01',
+                'category_id': category_ids[n % len(category_ids)]}
+        if n % 4 == 3:
+            data.update(is_transfer='on', transfer_to_budget_id=OTHER_BUDGET)
+        client.post(f'/budget/{MAIN_BUDGET}/add-transaction', data=data)
+    with app.app_context():
+        contested_ids = [t for (t,) in db.session.query(Transaction.id).filter(
+            Transaction.description.like('contested %'), Transaction.budget_id == MAIN_BUDGET)]
+    return category_ids, contested_ids
+
+
+def run_thread(app, worker, requests, category_ids, contested_ids, statuses, latencies):
+    rng = random.Random(worker)
+    client = app.test_client()
+    client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+    own = []
+
+    for n in range(requests):
+        description = f'w{worker}-{n}'
+        amount = f'{rng.randint(1, 5000) / 100:.2f}'
+        choice = rng.random()
+        contested = contested_ids and choice >= 0.85
+        if contested and choice < 0.92:
+            url, data = f'/transaction/{rng.choice(contested_ids)}/edit', {'category_id': rng.choice(category_ids)}
+        elif contested:
+            url, data = f'/transaction/{rng.choice(contested_ids)}/delete', None
+        elif choice < 0.4:
+            url, data = f'/budget/{MAIN_BUDGET}/add-transaction', {'category_id': rng.choice(category_ids)}
+        elif choice < 0.52:
+            url, data = f'/budget/{MAIN_BUDGET}/add-transaction', {'is_income': 'on'}
+        elif choice < 0.6:
+            url, data = f'/budget/{MAIN_BUDGET}/add-transaction', {'is_transfer': 'on', 'transfer_to_budget_id': OTHER_BUDGET}
+        elif choice < 0.68:
+            url, data = f'/budget/{OTHER_BUDGET}/add-transaction', {'is_transfer': 'on', 'transfer_to_budget_id': MAIN_BUDGET}
+        elif choice < 0.77 and own:
+            url, data = f'/transaction/{rng.choice(own)}/edit', {'category_id': rng.choice(category_ids)}
+        elif own:
+            url, data = f'/transaction/{own.pop(rng.randrange(len(own)))}/delete', None
+        else:
+            url, data = f'/budget/{MAIN_BUDGET}/add-transaction', {'is_income': 'on'}
+        if data is not None:
+            data.update(description=description, amount=amount, date=f'2024-{rng.randint(1, 12):02d}-01')
+
+        started = time.perf_counter()
+        response = client.post(url, data=data)
+        latencies.append(time.perf_counter() - started)
+        # Another thread deleted the contested row first
+        statuses['gone' if contested and response.status_code == 404 else response.status_code] += 1
+
+        if url.endswith('add-transaction') and response.status_code == 302:
+            with app.app_context():
+                # Edits use categories of the main budget, so only its rows qualify
+                own += [t for (t,) in db.session.query(Transaction.id).filter(
+                    Transaction.description == description, Transaction.budget_id == MAIN_BUDGET,
+                    Transaction.is_income == False)]
+
+
+def run_worker(db_path, worker, threads, requests, category_ids, contested_ids):
+    app = make_app(db_path)
+    statuses, latencies = Counter(), []
+    pool = [threading.Thread(target=run_thread, args=(app, worker * threads + i, requests, category_ids,
+                                                      contested_ids, statuses, latencies))
+            for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return dict(statuses), latencies
+
+
+def verify(db_path):
+    app = make_app(db_path)
+    with app.app_context():
+        mismatches = []
+        for budget in Budget.query.order_by(Budget.id):
+            rows = db.session.query(Transaction.is_income, db.func.sum(Transaction.amount_cents)) \
+                .filter(Transaction.budget_id == budget.id).group_by(Transaction.is_income).all()
+            totals = {is_income: amount for is_income, amount in rows}
+            expected = INITIAL_BALANCE_CENTS + totals.get(True, 0) - totals.get(False, 0)
+            if budget.balance_cents != expected:
+                mismatches.append(f'budget {budget.id} balance: stored {budget.balance_cents} != ledger {expected}')
+        for table, obj_id, field, stored, actual in reconcile_rollups(fix=False):
+            mismatches.append(f'{table} {obj_id} {field}: stored {stored} != ledger {actual}')
+        return mismatches, Transaction.query.count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check balances under concurrent writes to one budget.')
+    parser.add_argument('--db', default='bench_concurrent.db')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100, help='Requests per thread.')
+    parser.add_argument('--categories', type=int, default=5)
+    parser.add_argument('--contested', type=int, default=20,
+                        help='Rows that every thread edits and deletes.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    category_ids, contested_ids = seed(args.db, args.categories, args.contested)
+
+    started = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+        results = pool.starmap(run_worker, [(args.db, worker, args.threads, args.requests, category_ids,
+                                             contested_ids) for worker in range(args.processes)])
+    elapsed = time.perf_counter() - started
+
+    statuses, latencies = Counter(), []
+    for worker_statuses, worker_latencies in results:
+        statuses.update(worker_statuses)
+        latencies += worker_latencies
+    latencies.sort()
+    mismatches, ledger_rows = verify(args.db)
+    failed = sum(count for status, count in statuses.items() if status != 'gone' and status >= 400)
+
+    report = {
+        'writers': args.processes * args.threads,
+        'requests': len(latencies),
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        'ledger_rows': ledger_rows,
+        'mismatches': mismatches,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['requests']} writes from {report['writers']} writers in {report['seconds']}s "
+              f"({report['requests_per_second']} req/s), p50 {report['p50_ms']}ms, p99 {report['p99_ms']}ms")
+        print(f"Statuses: {report['statuses']}, ledger rows: {ledger_rows}")
+        for mismatch in mismatches:
+            print(mismatch)
+        print('FAILED' if mismatches or failed else 'OK: balances and running totals match the ledger')
+    if mismatches or failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# Compares query plans and latency of the hot query shapes with and without
+# the composite indexes declared on Transaction and Category.
+#
+#   python benchmarks/indexes.py --transactions 2000000 --db /tmp/bench.db
+#
+# The database is seeded directly through SQLAlchemy Core so that a
+# multi-million-row ledger can be generated in a reasonable time.
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, select, func, case, and_, or_, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import db, Budget, Category, Transaction, User  # noqa: E402
+
+budget_table = Budget.__table__
+category_table = Category.__table__
+transaction_table = Transaction.__table__
+INDEXED_TABLES = (category_table, transaction_table)
+
+
+def seed(engine, budgets, categories, transactions, batch_size=50000):
+    rng = random.Random(42)
+    db.metadata.create_all(engine)
+    for table in INDEXED_TABLES:
+        for index in table.indexes:
+            index.drop(engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{'id': 1, 'username': 'bench', 'password_hash': ''}])
+        conn.execute(budget_table.insert(), [
+            {'id': b, 'name': f'Budget {b}', 'user_id': 1, 'balance_cents': 0, 'total_income_cents': 0, 'total_spent_cents': 0}
+            for b in range(1, budgets + 1)
+        ])
+        conn.execute(category_table.insert(), [
+            {'id': c, 'name': f'Category {c}', 'budget_id': (c - 1) % budgets + 1, 'budgeted_amount_cents': 10000,
+             'is_future_expense': c % 5 == 0, 'is_transfer': False, 'total_income_cents': 0, 'total_spent_cents': 0}
+            for c in range(1, categories + 1)
+        ])
+
+    start = date.today() - timedelta(days=5 * 365)
+    for offset in range(0, transactions, batch_size):
+        rows = []
+        for i in range(offset, min(offset + batch_size, transactions)):
+            category_id = rng.randint(1, categories)
+            budget_id = (category_id - 1) % budgets + 1
+            is_income = rng.random() < 0.1
+            rows.append({
+                'id': i + 1,
+                'description': f'Transfer from Budget {rng.randint(1, budgets)}' if is_income else f'Purchase {i % 997}',
+                'amount_cents': rng.randint(100, 50000),
+                'date': start + timedelta(days=rng.randint(0, 5 * 365)),
+                'budget_id': budget_id,
+                'category_id': None if is_income else category_id,
+                'is_income': is_income,
+                'is_transfer': False,
+            })
+        with engine.begin() as conn:
+            conn.execute(transaction_table.insert(), rows)
+
+
+def hot_queries(budgets):
+    budget_id = budgets // 2 + 1
+    cursor_date, cursor_id = date.today() - timedelta(days=3 * 365), 10 ** 9
+    t = transaction_table
+    totals = (
+        func.sum(case((t.c.is_income == True, t.c.amount_cents), else_=0)),
+        func.sum(case((t.c.is_income == False, t.c.amount_cents), else_=0)),
+    )
+    return {
+        'budget_totals': select(t.c.budget_id, *totals).where(t.c.budget_id == budget_id).group_by(t.c.budget_id),
+        'expenses_by_budget': select(func.count()).where(and_(t.c.budget_id == budget_id, t.c.is_income == False)),
+        'category_totals': select(t.c.category_id, *totals)
+            .join(category_table, category_table.c.id == t.c.category_id)
+            .where(category_table.c.budget_id == budget_id).group_by(t.c.category_id),
+        'future_categories': select(category_table.c.id)
+            .where(and_(category_table.c.budget_id == budget_id, category_table.c.is_future_expense == True)),
+        'transactions_first_page': select(t.c.id).where(t.c.budget_id == budget_id)
+            .order_by(t.c.date.desc(), t.c.id.desc()).limit(50),
+        'transactions_deep_page': select(t.c.id).where(and_(t.c.budget_id == budget_id, or_(
+                t.c.date < cursor_date, and_(t.c.date == cursor_date, t.c.id < cursor_id))))
+            .order_by(t.c.date.desc(), t.c.id.desc()).limit(50),
+        'transfer_source_lookup': select(t.c.id).where(t.c.transfer_mirror_id == cursor_id),
+    }
+
+
+def measure(engine, queries, repeat):
+    results = {}
+    with engine.connect() as conn:
+        for name, query in queries.items():
+            compiled = query.compile(engine, compile_kwargs={'literal_binds': True})
+            plan = [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {compiled}'))]
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                conn.execute(query).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {'plan': plan, 'median_ms': round(statistics.median(timings), 3),
+                             'max_ms': round(max(timings), 3)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot query shapes with and without indexes.')
+    parser.add_argument('--db', default='bench_indexes.db')
+    parser.add_argument('--budgets', type=int, default=200)
+    parser.add_argument('--categories', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=2000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--reuse', action='store_true', help='Reuse an already seeded database.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+
+    if not args.reuse and os.path.exists(args.db):
+        os.remove(args.db)
+    engine = create_engine(f'sqlite:///{args.db}')
+
+    if not args.reuse:
+        started = time.perf_counter()
+        seed(engine, args.budgets, args.categories, args.transactions)
+        print(f'Seeded {args.transactions} transactions in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+    for table in INDEXED_TABLES:
+        for index in table.indexes:
+            index.drop(engine, checkfirst=True)
+    queries = hot_queries(args.budgets)
+    before = measure(engine, queries, args.repeat)
+
+    started = time.perf_counter()
+    for table in INDEXED_TABLES:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(text('ANALYZE'))
+    index_build_s = time.perf_counter() - started
+    after = measure(engine, queries, args.repeat)
+
+    report = {
+        'transactions': args.transactions,
+        'index_build_s': round(index_build_s, 2),
+        'queries': {name: {'without_indexes': before[name], 'with_indexes': after[name]} for name in queries},
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Index build: {report['index_build_s']}s")
+    for name, result in report['queries'].items():
+        without, with_ = result['without_indexes'], result['with_indexes']
+        print(f"\n{name}: {without['median_ms']}ms -> {with_['median_ms']}ms")
+        print(f"  without: {'; '.join(without['plan'])}")
+        print(f"  with:    {'; '.join(with_['plan'])}")
+
+
+if __name__ == '__main__':
+    main()
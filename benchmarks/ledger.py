@@ -0,0 +1,187 @@
+# Seeds a database with a synthetic ledger: users owning budgets with
+# categories (some of them future expenses) and a few years of income, expenses and
+# transfers between budgets, with balances and running totals that match.
+#
+#   python benchmarks/ledger.py --db bench_ledger.db --users 20 --budgets 100 --transactions 1000000
+#
+# Rows are written through SQLAlchemy Core in large batches. Every user has
+# the password PASSWORD so that load drivers can log in as any of them.
+# Relative --db paths are taken from the current directory, not the app's
+# instance folder. An existing file is only replaced with --force.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import insert, update
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, db, upgrade_db, Budget, Category, Transaction, User  # noqa: E402
+
+PASSWORD = 'benchmark'
+INITIAL_BALANCE_CENTS = 500000
+MERCHANTS = ('Grocery store', 'Coffee shop', 'Fuel station', 'Pharmacy', 'Bookshop', 'Hardware store',
+             'Restaurant', 'Cinema', 'Taxi', 'Bakery', 'Electricity', 'Internet', 'Insurance', 'Gym')
+
+
+def make_app(db_path, **config):
+    return create_app(dict({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(db_path)}',
+                            'SECRET_KEY': 'benchmark', 'PAGE_CACHE_URL': 'null://',
+                            # Compiled templates would go to the repo's instance folder
+                            'TEMPLATE_CACHE_DIR': None}, **config))
+
+
+def remove_db(db_path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+
+def replace_db(db_path, force):
+    # Clears the way for a fresh seed, refusing to delete a database that
+    # may not be a benchmark's own
+    if os.path.exists(db_path) and not force:
+        raise SystemExit(f'{db_path} already exists; pass --force to replace it')
+    remove_db(db_path)
+
+
+def owner(budget_id, users):
+    # Budgets are dealt out to the users in turn
+    return (budget_id - 1) % users + 1
+
+
+def generate(db_path, users=10, budgets=50, categories=10, transactions=100000, transfer_ratio=0.05,
+             income_ratio=0.1, years=3, seed=42, batch_size=50000):
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    app = make_app(db_path)
+    with app.app_context():
+        upgrade_db()
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(insert(User), [
+            {'id': u, 'username': f'user{u}', 'password_hash': password_hash} for u in range(1, users + 1)
+        ])
+        db.session.execute(insert(Budget), [
+            {'id': b, 'name': f'Budget {b}', 'user_id': owner(b, users), 'balance_cents': INITIAL_BALANCE_CENTS}
+            for b in range(1, budgets + 1)
+        ])
+        today = date.today()
+        category_rows = []
+        for b in range(1, budgets + 1):
+            for k in range(categories):
+                future = k % 5 == 4
+                category_rows.append({
+                    'id': (b - 1) * categories + k + 1, 'name': f'Category {k + 1}', 'budget_id': b,
+                    'budgeted_amount_cents': rng.randint(50, 500) * 100, 'is_future_expense': future,
+                    'is_transfer': False, 'target_date': today + timedelta(days=rng.randint(90, 720)) if future else None,
+                    'target_amount_cents': rng.randint(500, 5000) * 100 if future else None,
+                })
+        if category_rows:
+            db.session.execute(insert(Category), category_rows)
+
+        budget_totals = defaultdict(lambda: [0, 0])
+        category_totals = defaultdict(lambda: [0, 0])
+        start = today - timedelta(days=365 * years)
+        next_id = 1
+        rows = []
+
+        def add(**row):
+            nonlocal next_id
+            row.setdefault('category_id', None)
+            row.setdefault('is_transfer', False)
+            row.setdefault('transfer_to_budget_id', None)
+            row.setdefault('transfer_mirror_id', None)
+            row['id'] = next_id
+            next_id += 1
+            rows.append(row)
+            totals = 0 if row['is_income'] else 1
+            budget_totals[row['budget_id']][totals] += row['amount_cents']
+            if row['category_id']:
+                category_totals[row['category_id']][totals] += row['amount_cents']
+            return row['id']
+
+        for n in range(transactions):
+            budget_id = rng.randint(1, budgets)
+            day = start + timedelta(days=rng.randint(0, 365 * years))
+            amount_cents = rng.randint(100, 50000)
+            choice = rng.random()
+            # Transfers go to another budget of the same owner
+            targets = range(owner(budget_id, users), budgets + 1, users)
+            if choice < transfer_ratio and len(targets) > 1:
+                target_id = rng.choice([b for b in targets if b != budget_id])
+                # The mirror is written first, like add_transaction() does
+                mirror_id = add(description=f'Transfer from Budget {budget_id}', amount_cents=amount_cents, date=day,
+                                budget_id=target_id, is_income=True)
+                add(description=f'Transfer to Budget {target_id}', amount_cents=amount_cents, date=day,
+                    budget_id=budget_id, is_income=False, is_transfer=True, transfer_to_budget_id=target_id,
+                    transfer_mirror_id=mirror_id)
+            elif choice < transfer_ratio + income_ratio or not categories:
+                add(description=rng.choice(('Salary', 'Refund', 'Interest')), amount_cents=amount_cents * 5,
+                    date=day, budget_id=budget_id, is_income=True)
+            else:
+                add(description=f'{rng.choice(MERCHANTS)} {n % 997}', amount_cents=amount_cents, date=day,
+                    budget_id=budget_id, category_id=(budget_id - 1) * categories + rng.randint(1, categories),
+                    is_income=False)
+            if len(rows) >= batch_size:
+                db.session.execute(insert(Transaction), rows)
+                rows = []
+        if rows:
+            db.session.execute(insert(Transaction), rows)
+
+        db.session.execute(update(Budget), [
+            {'id': b, 'balance_cents': INITIAL_BALANCE_CENTS + income - spent,
+             'total_income_cents': income, 'total_spent_cents': spent}
+            for b, (income, spent) in budget_totals.items()
+        ])
+        if category_totals:
+            db.session.execute(update(Category), [
+                {'id': c, 'total_income_cents': income, 'total_spent_cents': spent}
+                for c, (income, spent) in category_totals.items()
+            ])
+        db.session.commit()
+
+    return {
+        'users': users,
+        'budgets': budgets,
+        'categories': budgets * categories,
+        'transactions': next_id - 1,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--budgets', type=int, default=50)
+    parser.add_argument('--categories', type=int, default=10, help='Categories per budget.')
+    parser.add_argument('--transactions', type=int, default=100000,
+                        help='Ledger entries to generate; a transfer adds a second, mirrored row.')
+    parser.add_argument('--transfer-ratio', type=float, default=0.05)
+    parser.add_argument('--income-ratio', type=float, default=0.1)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def generate_from_args(db_path, args):
+    return generate(db_path, users=args.users, budgets=args.budgets, categories=args.categories,
+                    transactions=args.transactions, transfer_ratio=args.transfer_ratio,
+                    income_ratio=args.income_ratio, years=args.years, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a database with a synthetic ledger.')
+    parser.add_argument('--db', default='bench_ledger.db')
+    parser.add_argument('--force', action='store_true', help='Replace --db if it already exists.')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    replace_db(args.db, args.force)
+    print(json.dumps(generate_from_args(args.db, args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# Measures latency percentiles and SQL statement counts of the page and
+# write routes on a synthetic ledger (see ledger.py).
+#
+#   python benchmarks/routes.py --transactions 200000 --threads 8 --requests 50 --force --output before.json
+#   python benchmarks/routes.py --reuse --output after.json --compare before.json
+#
+# Routes are measured one at a time. Each of --threads threads logs in as a
+# different user with its own test client and sends --requests requests to
+# random budgets of that user, so the
+# numbers include lock and GIL contention between concurrent requests. Query
+# counts come from the X-Query-Count header of query debug mode, which also
+# turns a route going over its query budget into a failed request. The page
+# cache is off unless --cache is given.
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import db, Budget, Category, Transaction, User  # noqa: E402
+from ledger import PASSWORD, add_arguments, generate_from_args, make_app, replace_db  # noqa: E402
+
+
+def random_day(rng):
+    return (date.today() - timedelta(days=rng.randint(0, 365))).isoformat()
+
+
+def expense(rng, ledger, budget_id, n):
+    return {'description': f'bench {n}', 'amount': f'{rng.randint(100, 20000) / 100:.2f}', 'date': random_day(rng),
+            'category_id': rng.choice(ledger['categories'][budget_id] or [''])}
+
+
+def add_transaction(rng, ledger, worker, n):
+    budget_id = rng.choice(ledger['budgets'])
+    return 'POST', f'/budget/{budget_id}/add-transaction', expense(rng, ledger, budget_id, n)
+
+
+def add_transfer(rng, ledger, worker, n):
+    budget_id, target_id = rng.sample(ledger['budgets'], 2)
+    data = expense(rng, ledger, budget_id, n)
+    data.update(is_transfer='on', transfer_to_budget_id=target_id)
+    return 'POST', f'/budget/{budget_id}/add-transaction', data
+
+
+def edit_transaction(rng, ledger, worker, n):
+    transaction_id, budget_id = rng.choice(ledger['editable'])
+    return 'POST', f'/transaction/{transaction_id}/edit', expense(rng, ledger, budget_id, n)
+
+
+def delete_transaction(rng, ledger, worker, n):
+    transaction_id, budget_id = ledger['deletable'].pop()
+    return 'POST', f'/transaction/{transaction_id}/delete', None
+
+
+def add_category(rng, ledger, worker, n):
+    return 'POST', f'/budget/{rng.choice(ledger["budgets"])}/add-category', \
+        {'name': f'bench {worker}-{n}', 'budgeted_amount': str(rng.randint(10, 500))}
+
+
+def edit_category(rng, ledger, worker, n):
+    budget_id = rng.choice([b for b in ledger['budgets'] if ledger['categories'][b]])
+    return 'POST', f'/category/{rng.choice(ledger["categories"][budget_id])}/edit', \
+        {'name': f'Category {n}', 'budgeted_amount': str(rng.randint(10, 500))}
+
+
+def page(path):
+    return lambda rng, ledger, worker, n: ('GET', path.format(rng.choice(ledger['budgets'])), None)
+
+
+ROUTES = {
+    'dashboard': page('/dashboard'),
+    'view_budget': page('/budget/{}'),
+    'categories': page('/budget/{}/categories'),
+    'transactions': page('/budget/{}/transactions'),
+    'future_expenses': page('/budget/{}/future-expenses'),
+    'add_transaction': add_transaction,
+    'add_transfer': add_transfer,
+    'edit_transaction': edit_transaction,
+    'delete_transaction': delete_transaction,
+    'add_category': add_category,
+    'edit_category': edit_category,
+}
+
+
+def load_ledger(app, workers, deletes_per_worker):
+    # One view per worker of the ledger of the user it logs in as: budgets,
+    # categories, expenses to edit and expenses only this worker deletes
+    views = []
+    taken = set()
+    with app.app_context():
+        users = db.session.query(User.id, User.username).order_by(User.id).limit(workers).all()
+        for worker in range(workers):
+            user_id, username = users[worker % len(users)]
+            budgets = [b for (b,) in db.session.query(Budget.id).filter(Budget.user_id == user_id).order_by(Budget.id)]
+            categories = defaultdict(list)
+            for category_id, budget_id in db.session.query(Category.id, Category.budget_id) \
+                    .filter(Category.budget_id.in_(budgets)).order_by(Category.id):
+                categories[budget_id].append(category_id)
+            plain = [tuple(row) for row in db.session.query(Transaction.id, Transaction.budget_id).filter(
+                Transaction.budget_id.in_(budgets), Transaction.is_income == False,
+                Transaction.is_transfer == False, Transaction.id.notin_(taken)
+            ).order_by(func.random()).limit(200 + deletes_per_worker)]
+            taken.update(transaction_id for transaction_id, budget_id in plain[:deletes_per_worker])
+            views.append({'username': username, 'budgets': budgets, 'categories': categories,
+                          'deletable': plain[:deletes_per_worker], 'editable': plain[deletes_per_worker:]})
+    return views
+
+
+def run_thread(app, route, ledger, worker, requests, samples):
+    rng = random.Random(worker)
+    client = app.test_client()
+    client.post('/login', data={'username': ledger['username'], 'password': PASSWORD})
+    for n in range(requests):
+        method, url, data = route(rng, ledger, worker, n)
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        elapsed = time.perf_counter() - started
+        queries = response.headers.get('X-Query-Count')
+        samples.append((elapsed, response.status_code, int(queries) if queries is not None else None))
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(samples, seconds):
+    latencies = sorted(elapsed * 1000 for elapsed, status, queries in samples)
+    queries = sorted(q for elapsed, status, q in samples if q is not None)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for elapsed, status, q in samples if status >= 400),
+        'requests_per_second': round(len(samples) / seconds, 1),
+        'mean_ms': round(statistics.mean(latencies), 2),
+        'p50_ms': round(percentile(latencies, 0.5), 2),
+        'p90_ms': round(percentile(latencies, 0.9), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(latencies[-1], 2),
+        'queries': {'min': queries[0], 'median': statistics.median(queries), 'max': queries[-1]} if queries else None,
+    }
+
+
+def measure(app, name, ledger, threads, requests, warmup):
+    route = ROUTES[name]
+    if warmup:
+        run_thread(app, route, ledger[0], 0, warmup, [])
+    samples = []
+    pool = [threading.Thread(target=run_thread, args=(app, route, ledger[worker], worker, requests, samples))
+            for worker in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return summarize(samples, time.perf_counter() - started)
+
+
+def compare(report, baseline):
+    for name, result in report['routes'].items():
+        before = baseline['routes'].get(name)
+        if not before:
+            continue
+        change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+        queries = (before['queries'] or {}).get('max'), (result['queries'] or {}).get('max')
+        print(f"{name:20} p50 {before['p50_ms']:>8}ms -> {result['p50_ms']:>8}ms ({change:+.0f}%)  "
+              f"p99 {before['p99_ms']:>8}ms -> {result['p99_ms']:>8}ms  queries {queries[0]} -> {queries[1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark page and write routes on a synthetic ledger.')
+    parser.add_argument('--db', default='bench_routes.db')
+    parser.add_argument('--reuse', action='store_true', help='Reuse an already seeded database.')
+    parser.add_argument('--force', action='store_true', help='Replace --db if it already exists.')
+    parser.add_argument('--routes', nargs='+', choices=sorted(ROUTES), default=list(ROUTES))
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='Requests per thread and route.')
+    parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per route.')
+    parser.add_argument('--cache', default='null://', help='Page cache URL, e.g. memory://')
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    parser.add_argument('--compare', help='A previous JSON report to compare against.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    generated = None
+    if not args.reuse:
+        replace_db(args.db, args.force)
+        generated = generate_from_args(args.db, args)
+        print(f"Seeded {generated['transactions']} transactions in {generated['seconds']}s", file=sys.stderr)
+
+    app = make_app(args.db, QUERY_DEBUG=True, PAGE_CACHE_URL=args.cache)
+    deletes = (args.requests + args.warmup) if 'delete_transaction' in args.routes else 0
+    ledger = load_ledger(app, args.threads, deletes)
+
+    report = {
+        'generated': generated,
+        'threads': args.threads,
+        'requests_per_thread': args.requests,
+        'cache': args.cache,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'routes': {},
+    }
+    for name in args.routes:
+        report['routes'][name] = measure(app, name, ledger, args.threads, args.requests, args.warmup)
+        print(f"{name}: p50 {report['routes'][name]['p50_ms']}ms", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    elif args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    else:
+        for name, result in report['routes'].items():
+            queries = result['queries'] or {}
+            print(f"{name:20} p50 {result['p50_ms']:>8}ms  p90 {result['p90_ms']:>8}ms  p99 {result['p99_ms']:>8}ms  "
+                  f"{result['requests_per_second']:>7} req/s  queries {queries.get('median')}  errors {result['errors']}")
+    if any(result['errors'] for result in report['routes'].values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
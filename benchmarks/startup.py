@@ -0,0 +1,153 @@
+# Measures cold start and first-request latency: each run is a fresh Python
+# process that imports the app, creates it, optionally warms it up, logs in
+# and requests the dashboard twice.
+#
+#   python benchmarks/startup.py --repeat 10 --force --output before.json
+#   python benchmarks/startup.py --reuse --output after.json --compare before.json
+#
+# Scenarios:
+#   lazy          no warm-up and no compiled templates on disk (a first deploy)
+#   warm_up       warm_up() before the first request, no compiled templates on disk
+#   warm_restart  warm_up() with the templates compiled by an earlier process
+# The ledger is small on purpose so that the numbers are about startup rather
+# than the size of the queries.
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+SCENARIOS = {
+    'lazy': {'warm_up': False, 'clear_templates': True},
+    'warm_up': {'warm_up': True, 'clear_templates': True},
+    'warm_restart': {'warm_up': True, 'clear_templates': False},
+}
+
+
+def child(warm):
+    # Runs in the measured process; prints its timings as JSON
+    timings = {}
+    started = time.perf_counter()
+    import app
+    timings['import_s'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    flask_app = app.create_app()
+    timings['create_app_s'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if warm:
+        timings['warm_up'] = app.warm_up(flask_app)
+    timings['warm_up_s'] = time.perf_counter() - started
+
+    client = flask_app.test_client()
+    for name, method, url, data in (('login', 'POST', '/login', {'username': 'user1', 'password': 'benchmark'}),
+                                    ('first_dashboard', 'GET', '/dashboard', None),
+                                    ('second_dashboard', 'GET', '/dashboard', None)):
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        timings[f'{name}_ms'] = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400 or (name == 'login' and '/dashboard' not in response.location):
+            raise SystemExit(f'{method} {url} failed with {response.status_code}')
+    print(json.dumps(timings))
+
+
+def run(db_path, template_dir, scenario):
+    options = SCENARIOS[scenario]
+    if options['clear_templates']:
+        shutil.rmtree(template_dir, ignore_errors=True)
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.abspath(db_path)}', BUDGET_SECRET_KEY='benchmark',
+               BUDGET_CACHE_URL='null://', BUDGET_TEMPLATE_CACHE_DIR=os.path.abspath(template_dir))
+    command = [sys.executable, os.path.abspath(__file__), '--child']
+    if options['warm_up']:
+        command.append('--warm-up')
+    started = time.perf_counter()
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    timings = json.loads(output.splitlines()[-1])
+    timings['process_s'] = time.perf_counter() - started
+    return timings
+
+
+def summarize(runs):
+    keys = ('process_s', 'import_s', 'create_app_s', 'warm_up_s')
+    result = {key: round(statistics.median(r[key] for r in runs), 4) for key in keys}
+    for key in ('login_ms', 'first_dashboard_ms', 'second_dashboard_ms'):
+        result[key] = round(statistics.median(r[key] for r in runs), 2)
+    # Time from process start until the first page is served
+    result['ready_ms'] = round(statistics.median(
+        (r['import_s'] + r['create_app_s'] + r['warm_up_s']) * 1000 + r['login_ms'] + r['first_dashboard_ms']
+        for r in runs), 2)
+    return result
+
+
+def compare(report, baseline):
+    for name, result in report['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            continue
+        print(f"{name:14} first dashboard {before['first_dashboard_ms']:>8}ms -> {result['first_dashboard_ms']:>8}ms  "
+              f"ready {before['ready_ms']:>8}ms -> {result['ready_ms']:>8}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold start and first-request latency.')
+    parser.add_argument('--db', default='bench_startup.db')
+    parser.add_argument('--templates', default='bench_startup_templates',
+                        help='Compiled template directory used by the measured processes.')
+    parser.add_argument('--reuse', action='store_true', help='Reuse an already seeded database.')
+    parser.add_argument('--force', action='store_true', help='Replace --db if it already exists.')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=5, help='Processes started per scenario.')
+    parser.add_argument('--transactions', type=int, default=2000)
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    parser.add_argument('--compare', help='A previous JSON report to compare against.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--warm-up', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.warm_up)
+        return
+
+    if not args.reuse:
+        from ledger import generate, replace_db
+        replace_db(args.db, args.force)
+        generate(args.db, users=2, budgets=4, categories=5, transactions=args.transactions)
+
+    report = {
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'scenarios': {},
+    }
+    for name in args.scenarios:
+        # warm_restart needs the templates an earlier process compiled
+        if not SCENARIOS[name]['clear_templates']:
+            run(args.db, args.templates, name)
+        report['scenarios'][name] = summarize([run(args.db, args.templates, name) for _ in range(args.repeat)])
+        print(f"{name}: ready in {report['scenarios'][name]['ready_ms']}ms", file=sys.stderr)
+    shutil.rmtree(args.templates, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    elif args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    else:
+        for name, result in report['scenarios'].items():
+            print(f"{name:14} import {result['import_s'] * 1000:>7.1f}ms  create_app {result['create_app_s'] * 1000:>6.1f}ms  "
+                  f"warm_up {result['warm_up_s'] * 1000:>6.1f}ms  first dashboard {result['first_dashboard_ms']:>7}ms  "
+                  f"second {result['second_dashboard_ms']:>6}ms  ready {result['ready_ms']:>7}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+# gunicorn settings for wsgi:app, overridable through the environment
+import multiprocessing
+import os
+
+bind = os.environ.get('BUDGET_BIND', '0.0.0.0:6969')
+workers = int(os.environ.get('BUDGET_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('BUDGET_THREADS', 2))
+timeout = int(os.environ.get('BUDGET_TIMEOUT', 30))
+# Each worker opens its own connection pool after the fork
+preload_app = False
+accesslog = '-'
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import create_app, upgrade_db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "budget.db"}',
+        'PAGE_CACHE_URL': 'null://',
+        'TEMPLATE_CACHE_DIR': None,
+        'QUERY_DEBUG': True,
+        # Every request loads the user, the worst case for query budgets
+        'USER_CACHE_TTL': 0,
+    })
+    with app.app_context():
+        upgrade_db()
+    return app
+
+
+def login(app, username):
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'password': 'secret'})
+    response = client.post('/login', data={'username': username, 'password': 'secret'})
+    assert response.status_code == 302
+    return client
+
+
+def post(client, url, data=None, status=302):
+    response = client.post(url, data=data)
+    assert response.status_code == status, response.data[:500]
+    return response
+
+
+@pytest.fixture
+def client(app):
+    return login(app, 'alice')
@@ -0,0 +1,69 @@
+from datetime import date
+
+import pytest
+
+from app import db, Budget, Category, RecurringTransaction, Transaction
+from conftest import login, post
+
+TODAY = date.today().isoformat()
+
+
+@pytest.fixture
+def bob(app, client):
+    # alice owns budget 1 and its category 1, bob owns budget 2 and one of
+    # its expenses (transaction 1)
+    post(client, '/budget/create', {'name': 'Alice', 'initial_balance': '100'})
+    post(client, '/budget/1/add-category', {'name': 'Food', 'budgeted_amount': '50'})
+    bob = login(app, 'bob')
+    post(bob, '/budget/create', {'name': 'Bob', 'initial_balance': '100'})
+    post(bob, '/budget/2/add-transaction', {'description': 'Lunch', 'amount': '10', 'date': TODAY})
+    return bob
+
+
+def untouched(app):
+    with app.app_context():
+        category = db.session.get(Category, 1)
+        assert (category.total_income_cents, category.total_spent_cents) == (0, 0)
+        assert db.session.get(Budget, 2).balance_cents == 9000
+        assert Transaction.query.filter_by(category_id=1).count() == 0
+
+
+def test_add_transaction_rejects_another_budgets_category(app, bob):
+    post(bob, '/budget/2/add-transaction', {'description': 'Lunch', 'amount': '25', 'date': TODAY,
+                                            'category_id': '1'}, status=400)
+    untouched(app)
+
+
+def test_edit_transaction_rejects_another_budgets_category(app, bob):
+    post(bob, '/transaction/1/edit', {'description': 'Lunch', 'amount': '25', 'date': TODAY, 'category_id': '1'},
+         status=400)
+    untouched(app)
+
+
+def test_recurring_transaction_rejects_another_budgets_category(app, bob):
+    post(bob, '/budget/2/recurring', {'description': 'Rent', 'amount': '25', 'interval_count': '1',
+                                      'interval_unit': 'month', 'start_date': '2024-01-01', 'category_id': '1'},
+         status=400)
+    untouched(app)
+    with app.app_context():
+        assert RecurringTransaction.query.count() == 0
+
+
+def test_own_category_is_accepted(app, client, bob):
+    post(client, '/budget/1/add-transaction', {'description': 'Lunch', 'amount': '25', 'date': TODAY,
+                                               'category_id': '1'})
+    with app.app_context():
+        assert db.session.get(Category, 1).total_spent_cents == 2500
+
+
+@pytest.mark.parametrize('target', ['1', 'abc'])
+def test_transfers_to_budgets_out_of_reach_are_not_recorded(app, bob, target):
+    # Budget 1 is alice's and not shared with bob
+    transfer = {'description': 'Move', 'amount': '25', 'date': TODAY, 'is_transfer': 'on',
+                'transfer_to_budget_id': target}
+    post(bob, '/budget/2/add-transaction', transfer)
+    post(bob, '/transaction/1/edit', transfer)
+    with app.app_context():
+        assert [(t.transfer_to_budget_id, t.transfer_mirror_id) for t in Transaction.query.order_by(Transaction.id)] \
+            == [(None, None), (None, None)]
+        assert db.session.get(Budget, 1).balance_cents == 10000
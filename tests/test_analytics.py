@@ -0,0 +1,34 @@
+import pytest
+
+from conftest import post
+
+
+@pytest.mark.parametrize('query, error', [
+    ('bucket=month&start=0001-01-01', b'Dates must be between'),
+    ('bucket=day&start=9999-12-31&end=9999-12-31', b'Dates must be between'),
+    ('bucket=month&end=0001-06-01', b'Dates must be between'),
+    ('bucket=day&start=2020-01-01&end=2024-01-01', b'At most 1000 days'),
+    ('bucket=week&start=2000-01-01&end=2024-01-01', b'At most 1000 weeks'),
+])
+def test_out_of_range_requests_are_rejected(client, query, error):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '0'})
+    response = client.get(f'/budget/1/analytics?{query}')
+    assert response.status_code == 400
+    assert error in response.data
+
+
+def test_ranges_at_the_limits(client):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '0'})
+    assert len(client.get('/budget/1/analytics?bucket=day&start=2020-01-01&end=2022-09-26').json['periods']) == 1000
+    for query in ('start=0002-01-01&end=0002-03-01', 'start=9998-10-01&end=9998-12-31'):
+        assert client.get(f'/budget/1/analytics?bucket=month&{query}').json['periods'][-1][5:] in ('03-01', '12-01')
+
+
+@pytest.mark.parametrize('day, status', [('0001-01-01', 400), ('0002-01-01', 200), ('9998-12-31', 200),
+                                         ('9999-12-31', 400)])
+def test_balance_at_the_ends_of_the_calendar(client, day, status):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '10'})
+    response = client.get(f'/budget/1/balance?date={day}')
+    assert response.status_code == status
+    if status == 200:
+        assert response.json['balance'] == 10.0
@@ -0,0 +1,131 @@
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+import app as budget_app
+from app import db, reconcile_rollups, BalanceSnapshot, Budget, MonthlyTotal, Transaction
+from conftest import post
+
+TODAY = date.today().isoformat()
+
+
+@pytest.fixture
+def rival(app):
+    # A second session of the same user
+    client = app.test_client()
+    post(client, '/login', {'username': 'alice', 'password': 'secret'})
+    return client
+
+
+def race(monkeypatch, action):
+    # Runs action between the view reading its transaction and writing it.
+    # Its own thread gives it its own app context and DB session, like a
+    # request in another worker. Only the first attempt races.
+    original = budget_app.budget_or_404
+    pending = [action]
+    errors = []
+
+    def run():
+        try:
+            pending.pop()()
+        except Exception as error:
+            errors.append(error)
+
+    def budget_or_404(budget_id):
+        budget = original(budget_id)
+        if pending:
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+            if errors:
+                raise errors[0]
+        return budget
+
+    monkeypatch.setattr(budget_app, 'budget_or_404', budget_or_404)
+
+
+def expense(client, amount='10', **extra):
+    post(client, '/budget/1/add-transaction', dict({'description': 'Lunch', 'amount': amount, 'date': TODAY,
+                                                    'category_id': '1'}, **extra))
+
+
+@pytest.fixture
+def ledger(client):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '100'})
+    post(client, '/budget/create', {'name': 'Savings', 'initial_balance': '0'})
+    post(client, '/budget/1/add-category', {'name': 'Food', 'budgeted_amount': '50'})
+    expense(client)
+
+
+def balances(app):
+    with app.app_context():
+        assert reconcile_rollups(fix=False) == []
+        return [budget.balance_cents for budget in Budget.query.order_by(Budget.id)]
+
+
+def test_concurrent_deletes_revert_once(app, client, rival, ledger, monkeypatch):
+    race(monkeypatch, lambda: post(rival, '/transaction/1/delete'))
+    post(client, '/transaction/1/delete', status=404)
+    assert balances(app) == [10000, 0]
+
+
+def test_concurrent_transfer_deletes_revert_once(app, client, rival, ledger, monkeypatch):
+    expense(client, '30', is_transfer='on', transfer_to_budget_id='2')
+    race(monkeypatch, lambda: post(rival, '/transaction/3/delete'))
+    post(client, '/transaction/3/delete', status=404)
+    assert balances(app) == [9000, 0]
+
+
+def test_edit_after_concurrent_edit_reverts_latest_amount(app, client, rival, ledger, monkeypatch):
+    race(monkeypatch, lambda: post(rival, '/transaction/1/edit', {'description': 'Lunch', 'amount': '20',
+                                                                  'date': TODAY, 'category_id': '1'}))
+    post(client, '/transaction/1/edit', {'description': 'Lunch', 'amount': '30', 'date': TODAY, 'category_id': '1'})
+    assert balances(app) == [7000, 0]
+    with app.app_context():
+        assert db.session.get(Transaction, 1).amount_cents == 3000
+
+
+def test_edit_of_concurrently_deleted_transaction(app, client, rival, ledger, monkeypatch):
+    race(monkeypatch, lambda: post(rival, '/transaction/1/delete'))
+    post(client, '/transaction/1/edit', {'description': 'Lunch', 'amount': '30', 'date': TODAY, 'category_id': '1'},
+         status=404)
+    assert balances(app) == [10000, 0]
+
+
+def race_fill(monkeypatch, action):
+    # Runs action, from another thread, right after the first ledger
+    # aggregate of the request, so the totals computed predate its write
+    original = budget_app.ledger_buckets
+    pending = [action]
+
+    def ledger_buckets(*args):
+        totals = original(*args)
+        if pending:
+            thread = threading.Thread(target=pending.pop())
+            thread.start()
+            thread.join()
+        return totals
+
+    monkeypatch.setattr(budget_app, 'ledger_buckets', ledger_buckets)
+
+
+def test_monthly_totals_are_not_stored_from_before_a_write(app, client, rival, ledger, monkeypatch):
+    month = budget_app.add_months(date.today().replace(day=1), -2)
+    query = f'/budget/1/analytics?start={month}&end={budget_app.add_months(month, 1) - timedelta(days=1)}'
+    race_fill(monkeypatch, lambda: expense(rival, '25', date=month.isoformat()))
+    assert client.get(query).json['totals']['spent'] == [0.0]
+    with app.app_context():
+        assert MonthlyTotal.query.count() == 0
+    assert client.get(query).json['totals']['spent'] == [25.0]
+
+
+def test_balance_snapshots_are_not_stored_from_before_a_write(app, client, rival, ledger, monkeypatch):
+    month = budget_app.add_months(date.today().replace(day=1), -2)
+    # Snapshots start at the month after the first transaction
+    expense(client, date=budget_app.add_months(month, -1).isoformat())
+    race_fill(monkeypatch, lambda: expense(rival, '25', date=month.isoformat()))
+    client.get(f'/budget/1/balance?date={date.today()}')
+    with app.app_context():
+        assert BalanceSnapshot.query.count() == 0
+    assert client.get(f'/budget/1/balance?date={date.today()}').json['balance'] == 55.0
@@ -0,0 +1,34 @@
+import io
+
+from app import db, Transaction
+from conftest import post
+
+
+def upload(client, content, **extra):
+    return client.post('/budget/1/import', data=dict({'statement': (io.BytesIO(content), 'statement.csv')}, **extra),
+                       content_type='multipart/form-data', follow_redirects=True)
+
+
+def imported(app):
+    with app.app_context():
+        return [(t.description, t.amount_cents, t.is_income) for t in db.session.query(Transaction).order_by('id')]
+
+
+def test_statement_in_another_encoding(app, client):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '0'})
+    statement = 'date,description,amount\n2024-01-01,Café,-3.50\n'.encode('cp1252')
+    response = upload(client, statement)
+    assert response.status_code == 200
+    assert b'not valid utf-8-sig text' in response.data
+    assert imported(app) == []
+    upload(client, statement, encoding='cp1252')
+    assert imported(app) == [('Café', 350, False)]
+
+
+def test_comma_decimal_amounts_are_invalid_rows(app, client):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '0'})
+    response = upload(client, b'date,description,amount\n2024-01-01,Rent,"-1,234.56"\n2024-01-02,Lunch,"-12,50"\n'
+                              b'2024-01-03,Pay,"$1,000"\n')
+    assert b'1 invalid rows' in response.data
+    assert b'Unrecognised amount &#34;-12,50&#34;' in response.data
+    assert imported(app) == [('Rent', 123456, False), ('Pay', 100000, True)]
@@ -0,0 +1,153 @@
+import sqlite3
+
+import pytest
+
+from app import create_app, db, reconcile_rollups, upgrade_db, Budget, Category, Transaction
+
+# The schema before the first migration, as db.create_all() made it
+BASELINE_SCHEMA = '''
+CREATE TABLE user (
+    id INTEGER NOT NULL PRIMARY KEY,
+    username VARCHAR(80) NOT NULL UNIQUE,
+    password_hash VARCHAR(128) NOT NULL
+);
+CREATE TABLE budget (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    balance FLOAT,
+    created_at DATETIME
+);
+CREATE TABLE category (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    budget_id INTEGER NOT NULL REFERENCES budget (id),
+    budgeted_amount FLOAT,
+    is_future_expense BOOLEAN,
+    is_transfer BOOLEAN,
+    target_date DATE,
+    target_amount FLOAT
+);
+CREATE TABLE "transaction" (
+    id INTEGER NOT NULL PRIMARY KEY,
+    description VARCHAR(200) NOT NULL,
+    amount FLOAT NOT NULL,
+    date DATE NOT NULL,
+    budget_id INTEGER NOT NULL REFERENCES budget (id),
+    category_id INTEGER REFERENCES category (id),
+    is_income BOOLEAN,
+    is_transfer BOOLEAN,
+    transfer_to_budget_id INTEGER REFERENCES budget (id),
+    created_at DATETIME
+);
+'''
+
+
+def upgraded(tmp_path, budgets, transactions, categories=()):
+    # Writes a baseline database and runs every migration over it
+    path = tmp_path / 'old.db'
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.execute("INSERT INTO user (username, password_hash) VALUES ('alice', 'x')")
+    connection.executemany('INSERT INTO budget (id, name, balance, created_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+                           budgets)
+    connection.executemany('''
+        INSERT INTO category (id, name, budget_id, budgeted_amount, is_future_expense, is_transfer, target_date,
+                              target_amount)
+        VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+    ''', categories)
+    connection.executemany('''
+        INSERT INTO "transaction" (description, amount, date, budget_id, is_income, is_transfer,
+                                   transfer_to_budget_id, category_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', [row + (None,) * (8 - len(row)) for row in transactions])
+    connection.commit()
+    connection.close()
+    app = create_app({'TESTING': True, 'SECRET_KEY': 'test', 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+                      'PAGE_CACHE_URL': 'null://', 'TEMPLATE_CACHE_DIR': None})
+    with app.app_context():
+        upgrade_db()
+    return app
+
+
+def transfer(budget_id, to_budget_id, amount, day='2024-03-01'):
+    return ('Move', amount, day, budget_id, False, True, to_budget_id)
+
+
+def mirror(budget_name, budget_id, amount, day='2024-03-01'):
+    return (f'Transfer from {budget_name}', amount, day, budget_id, True, False, None)
+
+
+def mirrors(app):
+    with app.app_context():
+        return dict(db.session.query(Transaction.id, Transaction.transfer_mirror_id)
+                    .filter(Transaction.is_transfer == True).order_by(Transaction.id).all())
+
+
+@pytest.fixture
+def budgets():
+    return [(1, 'Main', 0), (2, 'Savings', 0), (3, 'Holiday', 0)]
+
+
+def test_transfers_are_linked_to_their_mirror(tmp_path, budgets):
+    app = upgraded(tmp_path, budgets, [
+        mirror('Main', 3, 40, '2024-02-01'),
+        transfer(1, 2, 25),
+        mirror('Main', 2, 25),
+        transfer(1, 3, 40, '2024-02-01'),
+        transfer(1, 2, 99),
+    ])
+    assert mirrors(app) == {2: 3, 4: 1, 5: None}
+
+
+def test_identical_transfers_get_a_mirror_each(tmp_path, budgets):
+    app = upgraded(tmp_path, budgets, [
+        transfer(1, 2, 25),
+        mirror('Main', 2, 25),
+        transfer(1, 2, 25),
+        mirror('Main', 2, 25),
+        transfer(1, 2, 25, '2024-03-05'),
+        mirror('Main', 2, 25, '2024-03-05'),
+    ])
+    assert mirrors(app) == {1: 2, 3: 4, 5: 6}
+
+
+def test_transfers_of_a_renamed_budget_are_linked(tmp_path, budgets):
+    budgets[0] = (1, 'Everyday', 0)
+    app = upgraded(tmp_path, budgets, [
+        transfer(1, 2, 25),
+        mirror('Main', 2, 25),
+        # Renamed after the transfer above and before this one
+        transfer(1, 2, 25),
+        mirror('Everyday', 2, 25),
+    ])
+    # The exact description is preferred, so the renamed mirror is left to
+    # the transfer that has no other match
+    assert mirrors(app) == {1: 4, 3: 2}
+
+
+def test_renamed_mirrors_must_match_the_date(tmp_path, budgets):
+    budgets[0] = (1, 'Everyday', 0)
+    app = upgraded(tmp_path, budgets, [
+        transfer(1, 2, 25),
+        mirror('Main', 2, 25, '2024-03-02'),
+    ])
+    assert mirrors(app) == {1: None}
+
+
+def test_float_amounts_become_cents(tmp_path):
+    app = upgraded(tmp_path, [(1, 'Main', 0.1 + 0.2), (2, 'Savings', 1234.565)], [
+        ('Pay', 1000.07, '2024-03-01', 1, True, False, None, 1),
+        ('Lunch', 12.3, '2024-03-02', 1, False, False, None, 1),
+        ('Fee', 0.1 + 0.7, '2024-03-03', 1, False, False, None, 2),
+        # Each rounds up to a cent; their float sum does not round to two
+        ('Tax', 0.005, '2024-03-04', 1, False, False, None, 2),
+        ('Tax', 0.005, '2024-03-05', 1, False, False, None, 2),
+        ('Refund', -4.99, '2024-03-06', 2, False, False),
+    ], categories=[(1, 'Food', 1, 50.1, False, None, None), (2, 'Car', 1, 0.29, True, '2030-01-01', 999.99)])
+    with app.app_context():
+        assert [(b.balance_cents, b.total_income_cents, b.total_spent_cents)
+                for b in Budget.query.order_by(Budget.id)] == [(30, 100007, 1312), (123457, 0, -499)]
+        assert [(c.budgeted_amount_cents, c.target_amount_cents, c.total_income_cents, c.total_spent_cents)
+                for c in Category.query.order_by(Category.id)] == [(5010, None, 100007, 1230), (29, 99999, 0, 82)]
+        assert [t.amount_cents for t in Transaction.query.order_by(Transaction.id)] == [100007, 1230, 80, 1, 1, -499]
+        assert reconcile_rollups(fix=False) == []
@@ -0,0 +1,60 @@
+from datetime import date
+
+import pytest
+
+from app import add_months, project_savings
+from conftest import post
+
+
+def goal(target_cents, saved_cents=0):
+    return {'id': 1, 'target_cents': target_cents, 'saved_cents': saved_cents,
+            'target_date': add_months(date(2024, 1, 1), 24)}
+
+
+def test_funded_date_at_the_current_rate():
+    # 100.00 a month towards the 1,000.00 left
+    months, [result] = project_savings([goal(150000, 50000)], {1: 60000}, date(2024, 1, 1), 'monthly', 182,
+                                       add_months(date(2024, 1, 1), 24))
+    assert result['funded_date'] == date(2024, 11, 1)
+
+
+@pytest.mark.parametrize('schedule', ['weekly', 'fortnightly', 'monthly'])
+def test_goal_out_of_reach_has_no_funded_date(schedule):
+    # 0.10 over half a year towards 50,000.00
+    months, [result] = project_savings([goal(5000000)], {1: 10}, date(2024, 1, 1), schedule, 182,
+                                       add_months(date(2024, 1, 1), 24))
+    assert result['funded_date'] is None
+    assert result['shortfall_cents'] > 0
+
+
+def test_future_expense_pages_with_a_tiny_contribution_rate(client):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '100'})
+    post(client, '/budget/1/add-category', {'name': 'House', 'budgeted_amount': '0', 'is_future_expense': 'on',
+                                            'target_date': add_months(date.today(), 24).isoformat(),
+                                            'target_amount': '50000'})
+    post(client, '/budget/1/add-transaction', {'description': 'Save', 'amount': '0.10',
+                                               'date': date.today().isoformat(), 'category_id': '1'})
+    assert client.get('/budget/1/future-expenses').status_code == 200
+    response = client.get('/budget/1/future-expenses/projection?schedule=weekly')
+    assert response.status_code == 200
+    assert response.json['goals'][0]['funded_date'] is None
+
+
+@pytest.mark.parametrize('schedule', ['weekly', 'monthly'])
+def test_projection_stops_at_the_horizon(schedule):
+    far = dict(goal(100000), target_date=date.max)
+    months, [result] = project_savings([far], {1: 10}, date(9990, 1, 1), schedule, 182, date.max)
+    assert months[-1] == date(9998, 12, 31)
+    assert result['funded_date'] is None
+
+
+def test_goals_due_at_the_end_of_the_calendar(client):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '100'})
+    post(client, '/budget/1/add-category', {'name': 'Heirloom', 'budgeted_amount': '0', 'is_future_expense': 'on',
+                                            'target_date': '9999-12-31', 'target_amount': '1000'})
+    assert client.get('/budget/1/future-expenses').status_code == 200
+    response = client.post('/budget/1/calculate-future-expense', data={'target_amount': '1000',
+                                                                       'target_date': '9999-12-31'})
+    assert response.json['paydays'] == 12 * 100
+    assert client.get('/budget/1/future-expenses/projection').status_code == 200
+    assert client.get('/budget/1/future-expenses/projection?until=9999-12-31').status_code == 400
@@ -0,0 +1,70 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app import QueryBudgetExceeded
+from conftest import post
+
+LAST_MONTH = (date.today().replace(day=1) - timedelta(days=1)).isoformat()
+
+
+def seed(client):
+    # Two budgets; budget 1 has a plain and a future expense category, an
+    # income, two expenses and a transfer (transactions 4 and 5 are its pair)
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '100'})
+    post(client, '/budget/create', {'name': 'Savings', 'initial_balance': '0'})
+    post(client, '/budget/1/add-category', {'name': 'Food', 'budgeted_amount': '50'})
+    post(client, '/budget/1/add-category', {'name': 'Car', 'budgeted_amount': '0', 'is_future_expense': 'on',
+                                            'target_date': '2030-01-01', 'target_amount': '1000'})
+    post(client, '/budget/1/add-transaction', {'description': 'Pay', 'amount': '1000', 'date': LAST_MONTH,
+                                               'is_income': 'on'})
+    post(client, '/budget/1/add-transaction', {'description': 'Lunch', 'amount': '12.30', 'date': LAST_MONTH,
+                                               'category_id': '1'})
+    post(client, '/budget/1/add-transaction', {'description': 'Save', 'amount': '100', 'date': LAST_MONTH,
+                                               'category_id': '2'})
+    post(client, '/budget/1/add-transaction', {'description': 'Move', 'amount': '200', 'date': LAST_MONTH,
+                                               'is_transfer': 'on', 'transfer_to_budget_id': '2'})
+
+
+def request_counts(client):
+    # Drives every budgeted view, with the heaviest variants of the writes:
+    # back-dated (invalidating closed months), categorized and transfers
+    yield 'main.dashboard', client.get('/dashboard')
+    yield 'main.view_budget', client.get('/budget/1')
+    yield 'main.categories', client.get('/budget/1/categories')
+    yield 'main.transactions', client.get('/budget/1/transactions')
+    yield 'main.future_expenses', client.get('/budget/1/future-expenses')
+    yield 'main.add_transaction', client.post('/budget/1/add-transaction', data={
+        'description': 'Dinner', 'amount': '20', 'date': LAST_MONTH, 'category_id': '1'})
+    yield 'main.add_transaction', client.post('/budget/1/add-transaction', data={
+        'description': 'Top up', 'amount': '50', 'date': LAST_MONTH, 'category_id': '1',
+        'is_transfer': 'on', 'transfer_to_budget_id': '2'})
+    yield 'main.edit_transaction', client.post('/transaction/2/edit', data={
+        'description': 'Lunch', 'amount': '15', 'date': date.today().isoformat(), 'category_id': '2'})
+    yield 'main.edit_transaction', client.post('/transaction/5/edit', data={
+        'description': 'Move', 'amount': '250', 'date': LAST_MONTH, 'category_id': '1', 'is_transfer': 'on',
+        'transfer_to_budget_id': '2'})
+    yield 'main.delete_transaction', client.post('/transaction/5/delete')
+    yield 'main.delete_transaction', client.post('/transaction/3/delete')
+    yield 'main.delete_category', client.post('/category/1/delete')
+
+
+@pytest.mark.parametrize('cache_url', ['null://', 'memory://'])
+def test_views_stay_within_query_budgets(app, client, cache_url):
+    app.config['PAGE_CACHE_URL'] = cache_url
+    seed(client)
+    budgets = app.config['QUERY_BUDGETS']
+    covered = set()
+    for endpoint, response in request_counts(client):
+        assert response.status_code < 400, (endpoint, response.status_code)
+        count = int(response.headers['X-Query-Count'])
+        assert count <= budgets[endpoint], f'{endpoint} ran {count} statements, budget {budgets[endpoint]}'
+        covered.add(endpoint)
+    assert covered == set(budgets)
+
+
+def test_exceeding_a_query_budget_fails(app, client):
+    seed(client)
+    app.config['QUERY_BUDGETS'] = dict(app.config['QUERY_BUDGETS'], **{'main.view_budget': 1})
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/budget/1')
@@ -0,0 +1,23 @@
+from datetime import date, timedelta
+
+from conftest import post
+
+
+def test_description_is_not_run_as_script(client):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '100'})
+    post(client, '/budget/1/recurring', {'description': "');alert(1);('", 'amount': '10', 'interval_count': '1',
+                                         'interval_unit': 'month',
+                                         'start_date': (date.today() + timedelta(days=40)).isoformat()})
+    page = client.get('/budget/1/recurring').data.decode()
+    assert 'onsubmit' not in page
+    assert 'data-description="&#39;);alert(1);(&#39;"' in page
+
+
+def test_day_of_month_out_of_range(client):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '100'})
+    for day_of_month in ('-3', '0', '32'):
+        response = client.post('/budget/1/recurring', data={
+            'description': 'Rent', 'amount': '500', 'interval_count': '1', 'interval_unit': 'month',
+            'start_date': '2024-01-31', 'day_of_month': day_of_month}, follow_redirects=True)
+        assert b'The day of the month must be between 1 and 31' in response.data
+    assert b'Rent' not in client.get('/budget/1/recurring').data
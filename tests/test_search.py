@@ -0,0 +1,60 @@
+import io
+from datetime import date
+
+import pytest
+
+from app import db
+from conftest import post
+
+TODAY = date.today().isoformat()
+
+
+@pytest.fixture(params=['fts', 'like'])
+def search(request, app, client, monkeypatch):
+    # Searches the full text index, or the LIKE fallback used by databases
+    # other than SQLite
+    with app.app_context():
+        dialect = db.engine.dialect
+
+    def search(terms):
+        with monkeypatch.context() as patch:
+            if request.param == 'like':
+                patch.setattr(dialect, 'name', 'postgresql')
+            response = client.get('/transactions/search', query_string={'q': terms})
+        assert response.status_code == 200
+        return [row['description'] for row in response.json['results']]
+    search.backend = request.param
+    return search
+
+
+def add(client, description):
+    post(client, '/budget/1/add-transaction', {'description': description, 'amount': '5', 'date': TODAY})
+
+
+def test_results_follow_inserts_edits_and_deletes(client, search):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '100'})
+    add(client, 'Lunch coffee')
+    add(client, 'Dinner')
+    assert search('coff') == ['Lunch coffee']
+    assert search('lunch COFFEE') == ['Lunch coffee']
+
+    client.post('/budget/1/import', data={'statement': (io.BytesIO(
+        f'date,description,amount\n{TODAY},Coffee beans,-9\n'.encode()), 'statement.csv')},
+        content_type='multipart/form-data')
+    assert sorted(search('coffee')) == ['Coffee beans', 'Lunch coffee']
+
+    post(client, '/transaction/1/edit', {'description': 'Lunch tea', 'amount': '5', 'date': TODAY})
+    assert search('coffee') == ['Coffee beans']
+    assert search('tea') == ['Lunch tea']
+
+    post(client, '/transaction/3/delete')
+    assert search('coffee') == []
+    assert search('dinner') == ['Dinner']
+
+
+def test_fallback_matches_inside_words(client, search):
+    post(client, '/budget/create', {'name': 'Main', 'initial_balance': '100'})
+    add(client, 'Lunch coffee')
+    # The full text index only matches word prefixes
+    assert search('ffee') == ([] if search.backend == 'fts' else ['Lunch coffee'])
+    assert search('100%_') == []
@@ -0,0 +1,28 @@
+import os
+import stat
+
+from app import load_secret_key
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_generated_key_is_private(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        key = load_secret_key(str(tmp_path))
+    finally:
+        os.umask(umask)
+    assert len(key) == 32
+    assert mode(tmp_path / 'secret_key') == 0o600
+    assert os.listdir(tmp_path) == ['secret_key']
+    assert load_secret_key(str(tmp_path)) == key
+
+
+def test_existing_key_is_made_private(tmp_path):
+    path = tmp_path / 'secret_key'
+    path.write_bytes(b'k' * 32)
+    path.chmod(0o644)
+    assert load_secret_key(str(tmp_path)) == b'k' * 32
+    assert mode(path) == 0o600